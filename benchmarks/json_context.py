@@ -0,0 +1,70 @@
+"""
+Compares full `json.loads` contexts with projected decoding of raw JSON contexts.
+
+    python -m benchmarks.json_context
+"""
+
+import json
+import timeit
+import tracemalloc
+
+from empyre import Empyre
+
+FIELDS = 12
+RUNS = 50
+
+
+def make_doc() -> bytes:
+    """A few hundred KB document where rules only read a dozen fields."""
+    doc = {f"field_{i}": {"value": i, "label": f"label {i}"} for i in range(FIELDS)}
+    doc["events"] = [
+        {"id": i, "ts": "2024-01-01T00:00:00", "tags": ["a", "b"], "data": {"x": i}}
+        for i in range(3000)
+    ]
+    doc["blob"] = "x" * 50_000
+    return json.dumps(doc).encode()
+
+
+def make_rules() -> list[dict]:
+    return [
+        {
+            "matchers": [
+                {"path": f"$.field_{i}.value", "op": "eq", "value": i},
+            ],
+            "outcomes": [
+                {"typ": "EVENT", "event_id": str(i), "outputs": [f"$.field_{i}.label"]}
+            ],
+        }
+        for i in range(FIELDS)
+    ]
+
+
+def measure(name: str, fun) -> None:
+    latency = timeit.timeit(fun, number=RUNS) / RUNS
+    tracemalloc.start()
+    fun()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<12} {latency * 1000:8.2f} ms {peak / 1024:10.1f} KiB peak")
+
+
+def main():
+    doc = make_doc()
+    engine = Empyre(make_rules())
+    print(f"Document: {len(doc) / 1024:.1f} KiB, {FIELDS} fields read")
+
+    def full():
+        engine.set_ctx(json.loads(doc))
+        return list(engine.outcomes())
+
+    def projected():
+        engine.set_ctx(doc)
+        return list(engine.outcomes())
+
+    assert len(full()) == len(projected()) == FIELDS
+    measure("json.loads", full)
+    measure("projected", projected)
+
+
+if __name__ == "__main__":
+    main()
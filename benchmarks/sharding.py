@@ -0,0 +1,52 @@
+"""
+Compares the memory of the rule set shards and the added fan-out latency.
+
+    python -m benchmarks.sharding
+"""
+
+import timeit
+
+from empyre import Empyre, ShardedEmpyre
+
+TENANTS = 100
+RULES = 5000
+RUNS = 50
+
+
+def make_rules() -> list[dict]:
+    return [
+        {
+            "matchers": [
+                {"path": "$.tenant", "op": "eq", "value": f"tenant_{i % TENANTS}"},
+                {"path": "$.amount", "op": "gt", "value": i},
+                {"path": "$.country", "op": "in", "value": ["IT", "FR", "DE"]},
+            ],
+            "outcomes": [{"typ": "EVENT", "event_id": str(i), "outputs": ["$.amount"]}],
+        }
+        for i in range(RULES)
+    ]
+
+
+def main():
+    rules = make_rules()
+    ctx = {"tenant": "tenant_1", "amount": 2500, "country": "IT"}
+    print(f"{RULES} rules, {TENANTS} tenants")
+
+    engine = Empyre(rules, ctx)
+    latency = timeit.timeit(lambda: list(engine.outcomes()), number=RUNS) / RUNS
+    print(f"{'in process':<20} {latency * 1000:8.2f} ms")
+
+    for shards, key in ((1, None), (4, None), (4, "$.tenant"), (16, "$.tenant")):
+        with ShardedEmpyre(rules, shards=shards, key=key) as sharded:
+            latency = timeit.timeit(lambda: sharded.outcomes(ctx), number=RUNS) / RUNS
+            memory = sharded.memory()
+            name = f"{shards} shards by {key or 'id'}"
+            print(
+                f"{name:<20} {latency * 1000:8.2f} ms"
+                f" {max(memory) / 1024:8.1f} MiB max shard RSS"
+                f" ({sum(memory) / 1024:.1f} MiB total)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,4 @@
+from .cache import ResultCache  # noqa
 from .engine import Empyre  # noqa
+from .registry import EngineRegistry  # noqa
+from .sharding import ShardedEmpyre  # noqa
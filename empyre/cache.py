@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+
+@dataclass
+class CacheStats:
+    """Counters of a ResultCache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class ResultCache:
+    """
+    A bounded cache of evaluation results, keyed by context fingerprints.
+    Entries are evicted when least recently used, or after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        if maxsize < 1:
+            raise ValueError("The cache size must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[Hashable, tuple[float, dict]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entry(self, key: Hashable) -> dict:
+        """
+        Returns the results stored for the key, creating an empty
+        entry on misses, evicting the least recently used one if full.
+        """
+        now = time.monotonic()
+        if key in self._entries:
+            created, results = self._entries[key]
+            if self.ttl is None or now - created < self.ttl:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return results
+            del self._entries[key]
+            self.stats.evictions += 1
+        self.stats.misses += 1
+        if len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+        results = {}
+        self._entries[key] = (now, results)
+        return results
+
+    def clear(self):
+        """Invalidates all the entries."""
+        self.stats.evictions += len(self._entries)
+        self._entries.clear()
@@ -2,6 +2,8 @@ from sqlalchemy import URL
 from sqlalchemy.orm import joinedload
 from sqlmodel import Session, SQLModel, create_engine
 
+from empyre.models import Rule
+
 from .sqlmodels import DbRule
 
 
@@ -16,12 +18,23 @@ class EmpyreDb:
         )
         self.engine = create_engine(db_uri, echo=True)
 
-    def load_rules(self):
+    def load_rules(self, tenant: str = None):
+        with Session(self.engine) as session:
+            return self._query_rules(session, tenant).all()
+
+    def tenant_rules(self, tenant: str = None) -> list[Rule]:
+        """Loads the rules of a tenant, converted to Rules."""
         with Session(self.engine) as session:
-            query = session.query(DbRule)
-            query = query.options(joinedload(DbRule.matchers))
-            query = query.options(joinedload(DbRule.outcomes))
-            return query.all()
+            return [rule.to_rule() for rule in self._query_rules(session, tenant)]
+
+    @staticmethod
+    def _query_rules(session: Session, tenant: str = None):
+        query = session.query(DbRule)
+        query = query.options(joinedload(DbRule.matchers))
+        query = query.options(joinedload(DbRule.outcomes))
+        if tenant is not None:
+            query = query.filter(DbRule.tenant == tenant)
+        return query
 
     def create_db(self):
         SQLModel.metadata.create_all(self.engine)
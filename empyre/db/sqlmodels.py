@@ -1,9 +1,11 @@
+import json
 from datetime import datetime
 from typing import Literal
 
 from sqlmodel import Field, Relationship, SQLModel, String
 
-from empyre.models import Comparator, EmpyreModel, Operator, OutcomeTypes
+from empyre.models import Comparator, EmpyreModel, Matcher, Operator, OutcomeTypes, Rule
+from empyre.transforms import get_transform
 
 
 class MatcherMatchers(SQLModel, table=True):
@@ -27,7 +29,23 @@ class DbMatcher(SQLModel, EmpyreModel, table=True):
     value: str | None = None
     value_type: str | None = None
     transform: str | None = None
-    matchers: list["DbMatcher"] = Relationship(link_model=MatcherMatchers)
+    matchers: list["DbMatcher"] = Relationship(
+        link_model=MatcherMatchers,
+        sa_relationship_kwargs={
+            "primaryjoin": "DbMatcher.id == MatcherMatchers.rule_id",
+            "secondaryjoin": "DbMatcher.id == MatcherMatchers.matcher_id",
+        },
+    )
+
+    def to_matcher(self) -> Matcher:
+        """Converts to a Matcher, casting the value with the `value_type` transform."""
+        value = self.value
+        if value is not None and self.value_type:
+            value = get_transform(self.value_type)(value)
+        data = self.model_dump(exclude={"value_type"}, exclude_none=True)
+        if self.matchers:
+            data["matchers"] = [sub.to_matcher() for sub in self.matchers]
+        return Matcher.model_validate({**data, "value": value})
 
 
 class DbOutcome(SQLModel, EmpyreModel, table=True):
@@ -42,6 +60,13 @@ class DbOutcome(SQLModel, EmpyreModel, table=True):
     event_id: str | None = None
     rule_id: int | None = None
 
+    def to_outcome(self) -> dict:
+        """Converts to an outcome definition, outputs are stored as a JSON list."""
+        outcome = self.model_dump(exclude_none=True)
+        if self.outputs:
+            outcome["outputs"] = json.loads(self.outputs)
+        return outcome
+
 
 class RuleMatchers(SQLModel, table=True):
     __tablename__ = "em_rule_matchers"
@@ -71,8 +96,20 @@ class DbRule(SQLModel, EmpyreModel, table=True):
     until: datetime | None = None
     active: bool = True
     root: bool = True
+    priority: int = 0
+    tenant: str | None = Field(default=None, index=True)
     comp: Comparator = Comparator.is_
     op: Literal[Operator.and_, Operator.or_] = Field(Operator.and_, sa_type=String)
 
     matchers: list[DbMatcher] = Relationship(link_model=RuleMatchers)
     outcomes: list[DbOutcome] = Relationship(link_model=RuleOutcomes)
+
+    def to_rule(self) -> Rule:
+        """Converts to a Rule."""
+        return Rule.model_validate(
+            {
+                **self.model_dump(exclude={"tenant"}, exclude_none=True),
+                "matchers": [matcher.to_matcher() for matcher in self.matchers],
+                "outcomes": [outcome.to_outcome() for outcome in self.outcomes],
+            }
+        )
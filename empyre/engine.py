@@ -1,11 +1,29 @@
 import logging
 import re
-from typing import Any
+from datetime import datetime
+from functools import cached_property
+from itertools import chain, islice
+from types import MappingProxyType
+from typing import Any, Iterable, Iterator, Mapping
 from uuid import uuid4
 
-from jsonpath_ng.ext import parse
+from .models import (
+    DataOutcome,
+    Matcher,
+    Operator,
+    Outcomes,
+    OutcomeTypes,
+    Rule,
+    Strategy,
+    compile_path,
+)
+from .cache import ResultCache
+from .projection import Projection, decode, fingerprint, paths_projection
 
-from .models import DataOutcome, Matcher, Operator, Outcomes, OutcomeTypes, Rule
+
+def _copy(outcomes: Iterable[Outcomes]) -> list[Outcomes]:
+    """Returns deep copies of the outcomes."""
+    return [outcome.model_copy(deep=True) for outcome in outcomes]
 
 
 class Empyre:
@@ -13,25 +31,85 @@ class Empyre:
 
     _logger = logging.getLogger("Empyre")
 
-    def __init__(self, rules: list[dict | Rule] = None, ctx: dict = None):
+    def __init__(
+        self,
+        rules: list[dict | Rule] = None,
+        ctx: dict | bytes | str = None,
+        strategy: Strategy = Strategy.all,
+        limit: int = None,
+        cache: ResultCache = None,
+    ):
         self.id = uuid4().hex
+        self.strategy = Strategy(strategy)
+        if not self.strategy.limited and limit is not None:
+            raise ValueError(f"The {self.strategy} strategy doesn't use a limit")
+        if self.strategy.limited and (
+            not isinstance(limit, int) or isinstance(limit, bool) or limit < 1
+        ):
+            raise ValueError(f"The {self.strategy} strategy needs a positive int limit")
+        self.limit = 1 if self.strategy == Strategy.first else limit
+        # Optional cache of the results for contexts with the same read values
+        self.cache = cache
         self._rules = {}
+        # Root rules, by priority
+        self._roots = []
+        # Ids of the root rules with cacheable results
+        self._cacheable = set()
+        # Next since/until boundary changing the rules applicability
+        self._boundary = None
+        # Version of the rule set, part of the cache keys
+        self._version = 0
         if rules:
             self.add_rules(rules)
-        self._ctx = ctx or {}
+        self.set_ctx(ctx or {})
 
     def _log(self, msg: str):
         self._logger.debug(f"Evaluation[{self.id}] {msg}")
 
-    def set_ctx(self, ctx: dict):
+    def set_ctx(self, ctx: dict | bytes | str):
+        """
+        Sets the context to evaluate.
+        Raw JSON contexts are decoded only where the rules will look.
+        """
+        if isinstance(ctx, (bytes, bytearray, str)):
+            ctx = decode(ctx, self.projection)
         self._ctx = ctx
+        # Values extracted by pure matchers, memoized for the current context
+        self._memo = {}
+
+    @cached_property
+    def projection(self) -> Projection:
+        """The part of the context read by the rules, None if it's unknown."""
+        return paths_projection(
+            path for rule in self._rules.values() for path in rule.paths
+        )
+
+    @property
+    def rules(self) -> Mapping[int, Rule]:
+        """The rules, by id."""
+        return MappingProxyType(self._rules)
+
+    @property
+    def roots(self) -> list[Rule]:
+        """The root rules, in evaluation order."""
+        return list(self._roots)
 
     def add_rules(self, rules: list[dict | Rule]):
         existing = len(self._rules)
         for i, rule in enumerate(rules or []):
             rule = Rule.model_validate(rule)
-            rule.id = rule.id or i + existing
+            rule.id = i + existing if rule.id is None else rule.id
             self._rules[rule.id] = rule
+        self._roots = sorted(
+            (rule for rule in self._rules.values() if rule.root),
+            key=lambda rule: -rule.priority,
+        )
+        self._cacheable = {rule.id for rule in self._roots if self._pure(rule)}
+        self._boundary = self._next_boundary()
+        # Previous results are not hit anymore, and will be evicted
+        self._version += 1
+        # Rules changed: the read part of the context is to be recomputed
+        self.__dict__.pop("projection", None)
 
     def outcomes(self):
         """
@@ -41,30 +119,131 @@ class Empyre:
         self._log(
             f"Evaluating rules {'-'.join(map(str, self._rules.values()))} rules against {self._ctx}"
         )
-        for rule in self._rules.values():
-            if not rule.applicable or not rule.root:
+        outcomes = chain.from_iterable(
+            outcomes for _, outcomes in self.matching_rules()
+        )
+        if self.strategy == Strategy.limit:
+            outcomes = islice(outcomes, self.limit)
+        yield from outcomes
+
+    def matching_rules(self) -> Iterator[tuple[Rule, Iterable[Outcomes]]]:
+        """
+        Returns a generator of the applicable, matching root rules by priority
+        with their outcomes, stopping as soon as the strategy is satisfied.
+        The outcomes limit of the `limit` strategy is not applied.
+        """
+        self._memo = {}
+        rules = self._results(self._cache_entry())
+        if self.strategy in {Strategy.first, Strategy.top}:
+            rules = islice(rules, self.limit)
+        return rules
+
+    def _results(
+        self, cached: dict | None
+    ) -> Iterator[tuple[Rule, Iterable[Outcomes]]]:
+        """
+        Yields the matching root rules with their outcomes, from the
+        cached results when available. Missing results are added to the cache.
+        """
+        for rule in self._roots:
+            if not rule.applicable:
                 continue
-            yield from self._eval_rule(rule)
+            if cached is None or rule.id not in self._cacheable:
+                if self._matches(rule):
+                    yield rule, self._rule_outcomes(rule)
+                continue
+            if rule.id not in cached:
+                # Store copies, as data outcomes are enriched in place
+                cached[rule.id] = self._matches(rule) and _copy(
+                    self._rule_outcomes(rule)
+                )
+            if cached[rule.id] is not False:
+                # Callers get copies, so they can't alter the cached results
+                yield rule, _copy(cached[rule.id])
 
-    def _eval_rule(self, rule: Rule):
+    def _cache_entry(self) -> dict | None:
         """
-        Checks if matchers produce the desired outcome. Yields outcomes for matching rules.
+        Returns the cached results for the current context,
+        or None when they can't be cached.
         """
+        if self.cache is None or self.projection is None or not self._cacheable:
+            return None
+        if self._boundary and datetime.now() >= self._boundary:
+            # Some rules changed applicability
+            self._version += 1
+            self._boundary = self._next_boundary()
+        try:
+            key = fingerprint(self._ctx, self.projection)
+        except TypeError:
+            return None
+        # Caches can be shared by engines with different rules
+        return self.cache.entry((self.id, self._version, key))
+
+    def _pure(self, rule: Rule, seen: set = None) -> bool:
+        """Checks that the rule and its child rules have no impure transforms."""
+        seen = seen or set()
+        seen.add(rule.id)
+        if not all(matcher.pure for matcher in rule.matchers):
+            return False
+        return all(
+            self._pure(self._rules[outcome.rule_id], seen)
+            for outcome in rule.outcomes
+            if outcome.typ == OutcomeTypes.RULE
+            and outcome.rule_id in self._rules
+            and outcome.rule_id not in seen
+        )
+
+    def _next_boundary(self) -> datetime | None:
+        """Returns the next since/until datetime of the rules."""
+        now = datetime.now()
+        return min(
+            (
+                boundary
+                for rule in self._rules.values()
+                for boundary in (rule.since, rule.until)
+                if boundary and boundary > now
+            ),
+            default=None,
+        )
+
+    def _matches(self, rule: Rule) -> bool:
+        """Checks if matchers produce the desired outcome."""
         matchers_result = self._match_matchers(rule.op, rule.matchers)
         self._log(
             f"{rule} with {len(rule.matchers)} matchers expects {rule.comp.truth} and matches {matchers_result}"
         )
-        if matchers_result == rule.comp.truth:
-            for outcome in rule.outcomes:
-                yield from self._produce(outcome)
+        return matchers_result == rule.comp.truth
 
-    @staticmethod
-    def _prepare_val(val: Any, matcher: Matcher) -> Any:
-        """Eventually casts/transforms the value."""
-        try:
-            return matcher.transform(val)
-        except (TypeError, ValueError):
-            return val
+    def _rule_outcomes(self, rule: Rule):
+        """Yields the outcomes of a matching rule."""
+        for outcome in rule.outcomes:
+            yield from self._produce(outcome)
+
+    def _eval_rule(self, rule: Rule):
+        """
+        Checks if matchers produce the desired outcome. Yields outcomes for matching rules.
+        """
+        if self._matches(rule):
+            yield from self._rule_outcomes(rule)
+
+    def _values(self, matcher: Matcher) -> list[Any]:
+        """
+        Extracts the values from the context using the matcher's jsonpath,
+        eventually transformed. Results of pure transforms are memoized
+        for the current context.
+        """
+        transform = matcher.transformer
+        pure = transform is None or transform.pure
+        key = (matcher.path, transform.spec if transform else None)
+        if pure and key in self._memo:
+            return self._memo[key]
+        values = [el.value for el in compile_path(matcher.path).find(self._ctx)]
+        if transform is not None:
+            # Eventually apply a transformation on the found values
+            values = transform.batch(values)
+        if pure:
+            self._memo[key] = values
+        return values
 
     def _match_value(self, matcher: Matcher) -> bool:
         """
@@ -73,10 +252,7 @@ class Empyre:
         jsonpath matches to the value using the operator.
         """
         matches = []
-        # Extract values from the context using the jsonpath
-        for el in parse(matcher.path).find(self._ctx):
-            # Eventually apply a transformation on the found value
-            val = self._prepare_val(el.value, matcher)
+        for val in self._values(matcher):
             if matcher.op == Operator.in_:
                 # IN: the value is in the matcher iterable
                 matches.append(val in matcher.value)
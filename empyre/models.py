@@ -1,10 +1,23 @@
 from datetime import datetime
 from enum import StrEnum
-from typing import Any, Callable, Literal
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Literal
 
 from jsonpath_ng.exceptions import JSONPathError
 from jsonpath_ng.ext import parse
-from pydantic import BaseModel, Field
+from jsonpath_ng.jsonpath import JSONPath
+from pydantic import BaseModel, Field, field_validator
+
+from .transforms import Transform, resolve
+
+
+@lru_cache(maxsize=4096)
+def compile_path(path: str) -> JSONPath:
+    """
+    Parses a jsonpath once, sharing the compiled path between all its users.
+    The cache is bounded, as paths come from many rule sets.
+    """
+    return parse(path)
 
 
 class CompNone:
@@ -86,6 +99,20 @@ class Operator(StrEnum):
         return getattr(value, f"__{self}__")
 
 
+class Strategy(StrEnum):
+    """How much of the matching rules an evaluation produces."""
+
+    all = "all"
+    first = "first"
+    top = "top"
+    limit = "limit"
+
+    @property
+    def limited(self) -> bool:
+        """Returns true for strategies needing a limit (top-k rules/first N outcomes)"""
+        return self in {self.top, self.limit}
+
+
 class EmpyreModel(BaseModel):
     """Base class for Empyre models"""
 
@@ -113,13 +140,46 @@ class Matcher(EmpyreModel):
     )
     op: Operator = Field(..., description="The comparison operator to use.")
     value: Any = Field(None, description="The value to compare against/with.")
-    transform: Callable = Field(
-        None, description="Optional values transformation before comparisons."
+    transform: str | Callable = Field(
+        None,
+        description=(
+            "Optional values transformation before comparisons, "
+            "either the name of a registered transform or a callable."
+        ),
     )
     matchers: list["Matcher"] = Field(
         None, description="Optional list of other Matchers to use with the given op."
     )
 
+    @field_validator("transform")
+    @classmethod
+    def check_transform(cls, transform: str | Callable | None):
+        """Fails early on unknown transform names."""
+        resolve(transform)
+        return transform
+
+    @property
+    def transformer(self) -> Transform | None:
+        """Returns the resolved transform, if any."""
+        return resolve(self.transform)
+
+    @property
+    def pure(self) -> bool:
+        """Returns false if this matcher or its sub-matchers use impure transforms."""
+        transform = self.transformer
+        if transform is not None and not transform.pure:
+            return False
+        return all(matcher.pure for matcher in self.matchers or ())
+
+    @property
+    def paths(self) -> Iterator[str]:
+        """Yields the jsonpaths read by this matcher and its sub-matchers."""
+        if self.path and not self.matchers:
+            # Matchers with sub-matchers don't read their own path
+            yield self.path
+        for matcher in self.matchers or ():
+            yield from matcher.paths
+
     def __repr__(self):
         cond_repr = f"{self.path} {self.comp} {self.op} {self.value}"
         if self.op.logical:
@@ -169,6 +229,18 @@ class DataOutcome(EmpyreModel):
     )
     data: dict = Field(default_factory=dict)
 
+    @property
+    def paths(self) -> Iterator[str]:
+        """Yields the outputs that are valid jsonpaths."""
+        for el in self.outputs:
+            if not isinstance(el, str):
+                continue
+            try:
+                compile_path(el)
+            except JSONPathError:
+                continue
+            yield el
+
     def enrich(self, ctx: dict) -> None:
         """
         Populates the data dict with either values extracted
@@ -176,7 +248,7 @@ class DataOutcome(EmpyreModel):
         """
         for el in self.outputs:
             try:
-                matches = parse(el).find(ctx)
+                matches = compile_path(el).find(ctx)
                 if not matches:
                     raise JSONPathError()
                 for match in matches:
@@ -205,6 +277,9 @@ class Rule(EmpyreModel):
     until: datetime | None = Field(None, description="Rule validity end.")
     active: bool = Field(True, description="Flag used to deactivate a rule.")
     root: bool = Field(True, description="Set this to false for child-only rules.")
+    priority: int = Field(
+        0, description="Rules with higher priority are evaluated first."
+    )
     comp: Comparator = Field(
         Comparator.is_, description="The expected truthness of the match."
     )
@@ -218,6 +293,15 @@ class Rule(EmpyreModel):
         default_factory=list, description="The outcomes in case of positive match."
     )
 
+    @property
+    def paths(self) -> Iterator[str]:
+        """Yields the jsonpaths read by the rule's matchers and outcomes."""
+        for matcher in self.matchers:
+            yield from matcher.paths
+        for outcome in self.outcomes:
+            if isinstance(outcome, DataOutcome):
+                yield from outcome.paths
+
     @property
     def applicable(self):
         """Checks the rule's activeness and time boundaries."""
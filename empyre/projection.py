@@ -0,0 +1,229 @@
+import json
+import re
+from json.decoder import JSONDecodeError, scanstring
+from typing import Any, Hashable, Iterable
+
+from jsonpath_ng.ext.arithmetic import Operation
+from jsonpath_ng.ext.filter import Filter
+from jsonpath_ng.ext.iterable import Len, SortedThis
+from jsonpath_ng.ext.string import Split, Str, Sub
+from jsonpath_ng.jsonpath import Child, Fields, Index, JSONPath, Root, Slice, This
+
+from .models import compile_path
+
+# A projection is a tree of the context keys to decode:
+#   {"foo": {"bar": None}, "baz": None}
+# where None means "the whole value". A None projection decodes everything.
+Projection = dict[str, "Projection | None"] | None
+
+_decoder = json.JSONDecoder()
+_ws = re.compile(r"[ \t\n\r]*")
+_STRING = r'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+_string = re.compile(_STRING, re.S)
+_scalar = re.compile(r"[^,}\]\s]+")
+_tokens = re.compile(rf"(?P<open>[\[{{])|(?P<close>[\]}}])|{_STRING}", re.S)
+
+
+def _nested(depth: int) -> re.Pattern:
+    """
+    Returns a regex matching containers nested up to the given depth,
+    so skipping values runs in the regex engine instead of a Python loop.
+    Possessive quantifiers prevent any backtracking.
+    """
+    inner = rf'(?:[^\[\]{{}}"]++|{_STRING})*+'
+    for _ in range(depth - 1):
+        inner = rf'(?:[^\[\]{{}}"]++|{_STRING}|[\[{{]{inner}[\]}}])*+'
+    return re.compile(rf"[\[{{]{inner}[\]}}]", re.S)
+
+
+_container = _nested(8)
+
+# Nodes reading only below the value they're applied to,
+# unlike eg. `parent` that walks back up the context.
+_BELOW = (Fields, Index, Slice, Filter, Len, SortedThis, Str, Sub, Split, This)
+
+
+def _chain(path: JSONPath) -> list[JSONPath]:
+    """Flattens a jsonpath in the list of its nodes."""
+    if isinstance(path, Child):
+        return _chain(path.left) + _chain(path.right)
+    return [path]
+
+
+def _plain(node: JSONPath) -> bool:
+    """Returns true for nodes selecting named fields."""
+    return isinstance(node, Fields) and "*" not in node.fields
+
+
+def _operation_projection(operation: Operation) -> Projection:
+    """Returns the projection needed by both sides of an arithmetic operation."""
+    operands = [operation.left, operation.right]
+    return merge(*(path_projection(op) for op in operands if isinstance(op, JSONPath)))
+
+
+def _fields_projection(nodes: list[Fields]) -> dict:
+    """
+    Returns the projection of a chain of plain fields:
+    nested keys, then the whole value from the last field.
+    """
+    projection = root = {}
+    for node in nodes[:-1]:
+        projection[node.fields[0]] = projection = {}
+    projection.update(dict.fromkeys(nodes[-1].fields))
+    return root
+
+
+def _plain_prefix(nodes: list[JSONPath]) -> int:
+    """
+    Returns the length of the chain of plain fields starting the path.
+    The rest of the path needs the whole value after the first
+    node that is not a plain field, or that has multiple fields.
+    """
+    end = 1
+    while end < len(nodes) and _plain(nodes[end]) and len(nodes[end - 1].fields) == 1:
+        end += 1
+    return end
+
+
+def path_projection(path: JSONPath | str) -> Projection:
+    """
+    Returns the projection of the context needed by the jsonpath.
+    The projection stops at the first node that is not a plain field,
+    and is None for paths that can't be analyzed (eg. `$..foo`, `parent`).
+    """
+    if isinstance(path, str):
+        path = compile_path(path)
+    if isinstance(path, Operation):
+        return _operation_projection(path)
+    nodes = _chain(path)
+    if isinstance(nodes[0], Root):
+        nodes = nodes[1:]
+    if not nodes or not _plain(nodes[0]):
+        # Can't project the root: need the full context
+        return None
+    end = _plain_prefix(nodes)
+    if not all(isinstance(node, _BELOW) for node in nodes[end:]):
+        return None
+    return _fields_projection(nodes[:end])
+
+
+def merge(*projections: Projection) -> Projection:
+    """Merges projections, keeping the widest one for each key."""
+    merged = {}
+    for projection in projections:
+        if projection is None:
+            return None
+        for key, sub in projection.items():
+            if key not in merged:
+                merged[key] = sub
+            elif merged[key] is not None:
+                merged[key] = sub and merge(merged[key], sub)
+    return merged
+
+
+def paths_projection(paths: Iterable[str]) -> Projection:
+    """Returns the projection needed by all the given jsonpaths."""
+    return merge(*map(path_projection, paths))
+
+
+def _skip(doc: str, idx: int) -> int:
+    """Returns the index after the JSON value starting at idx, without decoding it."""
+    char = doc[idx]
+    if char in "[{":
+        match = _container.match(doc, idx)
+        if match:
+            return match.end()
+        # Deeper nesting: count the brackets
+        depth = 0
+        for token in _tokens.finditer(doc, idx):
+            if token.lastgroup == "open":
+                depth += 1
+            elif token.lastgroup == "close":
+                depth -= 1
+                if not depth:
+                    return token.end()
+        raise JSONDecodeError("Unterminated container", doc, idx)
+    match = (_string if char == '"' else _scalar).match(doc, idx)
+    if not match:
+        raise JSONDecodeError("Expecting value", doc, idx)
+    return match.end()
+
+
+def _decode_object(doc: str, idx: int, projection: dict) -> tuple[dict, int]:
+    """
+    Decodes the JSON object starting at idx, decoding only the projected keys.
+    Returns the object and the index after its end.
+    """
+    obj = {}
+    idx = _ws.match(doc, idx + 1).end()
+    if doc[idx] == "}":
+        return obj, idx + 1
+    while True:
+        if doc[idx] != '"':
+            raise JSONDecodeError("Expecting property name", doc, idx)
+        key, idx = scanstring(doc, idx + 1)
+        idx = _ws.match(doc, idx).end()
+        if doc[idx] != ":":
+            raise JSONDecodeError("Expecting ':' delimiter", doc, idx)
+        idx = _ws.match(doc, idx + 1).end()
+        if key not in projection:
+            idx = _skip(doc, idx)
+        elif projection[key] is not None and doc[idx] == "{":
+            obj[key], idx = _decode_object(doc, idx, projection[key])
+        else:
+            obj[key], idx = _decoder.raw_decode(doc, idx)
+        idx = _ws.match(doc, idx).end()
+        if doc[idx] == "}":
+            return obj, idx + 1
+        if doc[idx] != ",":
+            raise JSONDecodeError("Expecting ',' delimiter", doc, idx)
+        idx = _ws.match(doc, idx + 1).end()
+
+
+def decode(doc: bytes | str, projection: Projection = None) -> Any:
+    """
+    Decodes a JSON document, skipping the objects and arrays
+    out of the projection. Skipped values are not validated.
+    """
+    if isinstance(doc, (bytes, bytearray)):
+        doc = doc.decode(json.detect_encoding(doc))
+    idx = _ws.match(doc).end()
+    if projection is None or not doc.startswith("{", idx):
+        return json.loads(doc)
+    try:
+        obj, idx = _decode_object(doc, idx, projection)
+    except IndexError:
+        raise JSONDecodeError("Unexpected end of document", doc, len(doc)) from None
+    if _ws.match(doc, idx).end() != len(doc):
+        raise JSONDecodeError("Extra data", doc, idx)
+    return obj
+
+
+_missing = object()
+
+
+def _freeze(val: Any) -> Hashable:
+    """Returns a hashable representation of a context value."""
+    if isinstance(val, dict):
+        return dict, tuple((key, _freeze(sub)) for key, sub in val.items())
+    if isinstance(val, (list, tuple)):
+        return type(val), tuple(map(_freeze, val))
+    if isinstance(val, (set, frozenset)):
+        return frozenset, frozenset(map(_freeze, val))
+    # Raises TypeError for unhashable values
+    hash(val)
+    # The type avoids collisions like 1 == 1.0 == True
+    return type(val), val
+
+
+def fingerprint(ctx: Any, projection: Projection) -> Hashable:
+    """
+    Returns a hashable fingerprint of the projected part of the context.
+    Raises TypeError for contexts with unhashable values.
+    """
+    if projection is None or not isinstance(ctx, dict):
+        return _freeze(ctx)
+    return tuple(
+        (key, fingerprint(ctx.get(key, _missing), sub))
+        for key, sub in projection.items()
+    )
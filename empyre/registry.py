@@ -0,0 +1,254 @@
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+from jsonpath_ng.exceptions import JSONPathError
+from pydantic import BaseModel
+
+from .cache import ResultCache
+from .engine import Empyre
+from .models import Matcher, Rule, compile_path
+from .projection import _freeze
+
+Loader = Callable[[str], list[dict | Rule]]
+
+
+@dataclass
+class TenantStats:
+    """Usage of a tenant's engine."""
+
+    hits: int = 0
+    loads: int = 0
+    memory: int = 0
+    last_used: float = None
+
+
+def _sizeof(obj: Any, seen: set[int]) -> int:
+    """
+    Returns the approximate memory of an object and what it references,
+    skipping the objects already seen.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, BaseModel):
+        size += _sizeof(obj.__dict__, seen)
+    elif isinstance(obj, dict):
+        size += sum(_sizeof(key, seen) + _sizeof(val, seen) for key, val in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(val, seen) for val in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        # eg. compiled jsonpaths
+        size += _sizeof(vars(obj), seen)
+    return size
+
+
+class _FrozenList(list):
+    """A list that can't be modified, still equal to the lists with the same items."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} is immutable")
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _immutable
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+class _FrozenDict(dict):
+    """A dict that can't be modified, still equal to the dicts with the same items."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} is immutable")
+
+    pop = popitem = clear = update = setdefault = _immutable
+    __setitem__ = __delitem__ = __ior__ = _immutable
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+def _frozen(val: Any) -> Any:
+    """Returns an immutable copy of a matcher value, comparing equal to it."""
+    if isinstance(val, dict):
+        return _FrozenDict({key: _frozen(sub) for key, sub in val.items()})
+    if isinstance(val, list):
+        return _FrozenList(map(_frozen, val))
+    if isinstance(val, tuple):
+        return tuple(map(_frozen, val))
+    if isinstance(val, set):
+        return frozenset(val)
+    return val
+
+
+class EngineRegistry:
+    """
+    Serves the engines of many tenants from a single process.
+    Tenants' rules are loaded on first use, identical matcher values and
+    compiled jsonpaths are shared between all the tenants, and the least
+    recently used engines are evicted when their memory exceeds `max_memory`
+    (in bytes). Shared values are immutable, while each tenant keeps its own
+    matchers and their metadata.
+    A tenant's memory includes its rules and the values only it uses,
+    values used by many tenants are accounted in `shared_memory`.
+    The tenants' result caches are not accounted: bound them with `maxsize`.
+    """
+
+    def __init__(
+        self,
+        loader: Loader,
+        max_memory: int = None,
+        cache_factory: Callable[[], ResultCache] = None,
+        **engine_kwargs,
+    ):
+        if "cache" in engine_kwargs:
+            raise ValueError("Tenants can't share a cache, use cache_factory")
+        self.loader = loader
+        self.max_memory = max_memory
+        # Builds a result cache for each tenant's Empyre
+        self.cache_factory = cache_factory
+        # Keyword arguments for the tenants' Empyre (strategy, limit...)
+        self.engine_kwargs = engine_kwargs
+        self.stats: dict[str, TenantStats] = {}
+        # Memory of the loaded engines and of the values used by many tenants
+        self.memory = 0
+        self.shared_memory = 0
+        self._engines: OrderedDict[str, Empyre] = OrderedDict()
+        # Shared matcher values and compiled paths, with their size and users
+        self._shared: dict[Hashable, Any] = {}
+        self._sizes: dict[Hashable, int] = {}
+        self._users: dict[Hashable, set[str]] = {}
+        # Shared objects used by each tenant, and the memory of its rules
+        self._keys: dict[str, set[Hashable]] = {}
+        self._rules_memory: dict[str, int] = {}
+
+    @classmethod
+    def from_db(cls, db, **kwargs) -> "EngineRegistry":
+        """Returns a registry loading the tenants' rules from an EmpyreDb."""
+        return cls(db.tenant_rules, **kwargs)
+
+    def __contains__(self, tenant: str) -> bool:
+        return tenant in self._engines
+
+    def __len__(self):
+        return len(self._engines)
+
+    def get(self, tenant: str) -> Empyre:
+        """Returns the engine of the tenant, loading it if needed."""
+        stats = self.stats.setdefault(tenant, TenantStats())
+        stats.last_used = time.monotonic()
+        if tenant in self._engines:
+            stats.hits += 1
+            self._engines.move_to_end(tenant)
+            return self._engines[tenant]
+        engine = self._load(tenant)
+        stats.loads += 1
+        self._engines[tenant] = engine
+        self._evict()
+        return engine
+
+    def evict(self, tenant: str):
+        """Drops the engine of the tenant, its shared objects are freed if unused."""
+        if self._engines.pop(tenant, None) is None:
+            return
+        for key in self._keys.pop(tenant):
+            self._release(tenant, key)
+        rules_memory = self._rules_memory.pop(tenant)
+        self.memory -= rules_memory
+        self.stats[tenant].memory -= rules_memory
+
+    def _load(self, tenant: str) -> Empyre:
+        keys = set()
+        try:
+            rules = [Rule.model_validate(rule) for rule in self.loader(tenant)]
+            for rule in rules:
+                for matcher in rule.matchers:
+                    self._intern(matcher, keys)
+            cache = self.cache_factory() if self.cache_factory else None
+            engine = Empyre(rules, cache=cache, **self.engine_kwargs)
+        except Exception:
+            # Drops the objects shared by the failed load
+            for key in keys - self._users.keys():
+                del self._shared[key], self._sizes[key]
+            raise
+        self._keys[tenant] = keys
+        for key in keys:
+            self._use(tenant, key)
+        # Shared objects are accounted on their own
+        seen = {id(self._shared[key]) for key in keys}
+        rules_memory = _sizeof(dict(engine.rules), seen)
+        self._rules_memory[tenant] = rules_memory
+        self.memory += rules_memory
+        self.stats[tenant].memory += rules_memory
+        return engine
+
+    def _intern(self, matcher: Matcher, keys: set[Hashable]):
+        """Replaces the matcher value with the shared one, sharing its path."""
+        for sub in matcher.matchers or ():
+            self._intern(sub, keys)
+        if matcher.path and not matcher.matchers:
+            self._share(("path", matcher.path), keys, compile_path, matcher.path)
+        if matcher.value is None:
+            return
+        try:
+            key = ("value", _freeze(matcher.value))
+        except TypeError:
+            # Unhashable values can't be compared
+            return
+        matcher.value = self._share(key, keys, _frozen, matcher.value)
+
+    def _share(
+        self, key: Hashable, keys: set[Hashable], make: Callable, arg: Any
+    ) -> Any:
+        """Returns the shared object with the given key, making it if needed."""
+        if key not in self._shared:
+            try:
+                self._shared[key] = make(arg)
+            except JSONPathError:
+                # Invalid paths fail on evaluation
+                return None
+            self._sizes[key] = _sizeof(self._shared[key], set())
+        keys.add(key)
+        return self._shared[key]
+
+    def _use(self, tenant: str, key: Hashable):
+        """Adds a tenant to the users of a shared object, updating the memory stats."""
+        users = self._users.setdefault(key, set())
+        size = self._sizes[key]
+        if not users:
+            self.memory += size
+            self.stats[tenant].memory += size
+        elif len(users) == 1:
+            # Becomes shared
+            (other,) = users
+            self.stats[other].memory -= size
+            self.shared_memory += size
+        users.add(tenant)
+
+    def _release(self, tenant: str, key: Hashable):
+        """Removes a tenant from the users of a shared object, freeing unused ones."""
+        users = self._users[key]
+        users.discard(tenant)
+        size = self._sizes[key]
+        if not users:
+            del self._users[key], self._shared[key], self._sizes[key]
+            self.memory -= size
+            self.stats[tenant].memory -= size
+        elif len(users) == 1:
+            # Not shared anymore
+            (other,) = users
+            self.stats[other].memory += size
+            self.shared_memory -= size
+
+    def _evict(self):
+        """Evicts the least recently used engines, keeping at least one."""
+        while (
+            self.max_memory is not None
+            and len(self._engines) > 1
+            and self.memory > self.max_memory
+        ):
+            self.evict(next(iter(self._engines)))
@@ -0,0 +1,285 @@
+import multiprocessing
+import numbers
+import os
+import pickle
+import resource
+from itertools import chain, islice
+from typing import Any, Mapping
+
+from .engine import Empyre
+from .models import (
+    Comparator,
+    Matcher,
+    Operator,
+    Outcomes,
+    OutcomeTypes,
+    Rule,
+    Strategy,
+    compile_path,
+)
+from .projection import decode, path_projection
+from .transforms import hash_bucket
+
+
+def _rss() -> int:
+    """
+    Returns the resident memory of the process, in KiB.
+    Peak memory is inherited from the parent process on spawn,
+    so it's only used where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _routing_key(value: Any) -> str | int | None:
+    """
+    Normalizes a context key value, so that values equal with `==`
+    go to the same shard: 1, 1.0 and True are all routed as 1.
+    Returns None for values that can't equal a partitioned value.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, numbers.Number):
+        try:
+            if int(value) == value:
+                return int(value)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return None
+
+
+def _partitionable(value: Any) -> bool:
+    """Only strings and integers are used to partition rules."""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def _serve(conn, rules: list[Rule], strategy: Strategy, limit: int | None):
+    """Worker loop: evaluates the contexts received on the pipe against its shard."""
+    engine = Empyre(rules, strategy=strategy, limit=limit)
+    while (msg := conn.recv()) is not None:
+        cmd, payload = msg
+        try:
+            if cmd == "eval":
+                engine.set_ctx(payload)
+                result = [
+                    (rule.id, list(outcomes))
+                    for rule, outcomes in engine.matching_rules()
+                ]
+            else:
+                result = _rss()
+        except Exception as e:
+            result = e
+        try:
+            conn.send(result)
+        except Exception as e:
+            # Unpicklable results: pickling fails before writing to the pipe
+            conn.send(RuntimeError(f"Can't send the shard result: {e!r}"))
+    conn.close()
+
+
+class ShardedEmpyre:
+    """
+    Evaluates a rule set partitioned across worker processes,
+    so that each process holds only its shard of the rules.
+
+    Without a key, root rules are partitioned by id and every context is
+    sent to all the shards. With a key (a jsonpath to a top-level field, eg.
+    "$.tenant") rules matching the key with `eq`/`in` are partitioned by the
+    key values, and contexts are only sent to the shard of their key value
+    and to the shards holding rules without a key matcher.
+    Child rules are copied in every shard referencing them.
+    """
+
+    def __init__(
+        self,
+        rules: list[dict | Rule],
+        shards: int = 2,
+        key: str = None,
+        strategy: Strategy = Strategy.all,
+        limit: int = None,
+    ):
+        if key is not None and path_projection(key) is None:
+            raise ValueError(f"Can't partition on {key!r}")
+        if shards < 1:
+            raise ValueError(f"Need at least one shard, not {shards}")
+        self.shards = shards
+        self.key = key
+        # Validates the rules and the strategy like a plain Empyre
+        engine = Empyre(rules, strategy=strategy, limit=limit)
+        self.strategy = engine.strategy
+        self.limit = engine.limit
+        # Global evaluation order of the root rules
+        self._ranks = {rule.id: i for i, rule in enumerate(engine.roots)}
+        # Shards to query for contexts with any key value
+        self._unkeyed = set()
+        partitions = [[] for _ in range(shards)]
+        for rule in engine.roots:
+            for shard in self._partition(rule):
+                partitions[shard].append(rule)
+        self._conns = []
+        self._workers = []
+        try:
+            for roots in partitions:
+                self._spawn(self._with_children(engine.rules, roots))
+        except BaseException:
+            # eg. unpicklable rules: stops the workers already started
+            self.close()
+            raise
+
+    def _spawn(self, rules: list[Rule]):
+        """Starts a worker process evaluating the given rules."""
+        # Workers stop as soon as the strategy is satisfied on their shard,
+        # outcomes limits are applied after the merge
+        strategy, limit = self.strategy, self.limit
+        if strategy == Strategy.limit:
+            strategy = Strategy.all
+        if not strategy.limited:
+            limit = None
+        ctx = multiprocessing.get_context("spawn")
+        conn, worker_conn = ctx.Pipe()
+        worker = ctx.Process(
+            target=_serve, args=(worker_conn, rules, strategy, limit), daemon=True
+        )
+        worker.start()
+        worker_conn.close()
+        self._conns.append(conn)
+        self._workers.append(worker)
+
+    def _partition(self, rule: Rule) -> set[int]:
+        """Returns the shards of a root rule."""
+        values = self._key_values(rule)
+        if values is None:
+            shard = hash_bucket(rule.id, self.shards)
+            if self.key is not None:
+                self._unkeyed.add(shard)
+            return {shard}
+        return {hash_bucket(value, self.shards) for value in values}
+
+    def _key_values(self, rule: Rule) -> list | None:
+        """
+        Returns the key values a rule can match, or None if the rule
+        can match any context or its key values can't be partitioned.
+        """
+        if self.key is None or rule.op != Operator.and_ or not rule.comp.truth:
+            return None
+        for matcher in rule.matchers:
+            if matcher.path == self.key:
+                values = self._matcher_key_values(matcher)
+                if values is not None:
+                    return values
+        return None
+
+    @staticmethod
+    def _matcher_key_values(matcher: Matcher) -> list | None:
+        """Returns the values matched by an `eq`/`in` matcher on the key."""
+        if matcher.comp != Comparator.is_ or matcher.transform is not None:
+            return None
+        if matcher.op == Operator.eq:
+            values = [matcher.value]
+        elif matcher.op == Operator.in_ and isinstance(
+            matcher.value, (list, tuple, set, frozenset)
+        ):
+            values = list(matcher.value)
+        else:
+            return None
+        return values if all(map(_partitionable, values)) else None
+
+    @staticmethod
+    def _with_children(rules: Mapping[int, Rule], roots: list[Rule]) -> list[Rule]:
+        """Adds to the roots the rules reachable with RULE outcomes, as non-root."""
+        shard = {rule.id: rule for rule in roots}
+        pending = list(roots)
+        while pending:
+            for outcome in pending.pop().outcomes:
+                if outcome.typ != OutcomeTypes.RULE or outcome.rule_id in shard:
+                    continue
+                child = rules[outcome.rule_id]
+                if child.root:
+                    # A root rule of another shard
+                    child = child.model_copy(update={"root": False})
+                shard[child.id] = child
+                pending.append(child)
+        return list(shard.values())
+
+    def _targets(self, ctx: dict | bytes | str) -> set[int]:
+        """Returns the shards to query for the context."""
+        if self.key is None:
+            return set(range(self.shards))
+        if isinstance(ctx, (bytes, bytearray, str)):
+            ctx = decode(ctx, path_projection(self.key))
+        keys = (_routing_key(match.value) for match in compile_path(self.key).find(ctx))
+        return self._unkeyed | {
+            hash_bucket(key, self.shards) for key in keys if key is not None
+        }
+
+    def _query(self, shards: set[int], cmd: str, payload: Any = None) -> list:
+        """Sends the command to the shards, then collects the results."""
+        # Pickled once: unpicklable payloads fail before reaching any shard
+        msg = pickle.dumps((cmd, payload))
+        sent = [shard for shard in shards if self._send(shard, msg)]
+        results = [self._recv(shard) for shard in sent]
+        results += [
+            RuntimeError(f"Shard {shard} is not running")
+            for shard in shards
+            if shard not in sent
+        ]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def _send(self, shard: int, msg: bytes) -> bool:
+        """Sends the pickled message to a shard, returns false if it's not running."""
+        try:
+            self._conns[shard].send_bytes(msg)
+        except OSError:
+            return False
+        return True
+
+    def _recv(self, shard: int) -> Any:
+        """Receives the result of a shard, or an error if the shard stopped."""
+        try:
+            return self._conns[shard].recv()
+        except (EOFError, OSError):
+            return RuntimeError(f"Shard {shard} stopped")
+
+    def outcomes(self, ctx: dict | bytes | str) -> list[Outcomes]:
+        """Returns the outcomes of the matching rules, merged from the shards."""
+        matching = {}
+        for result in self._query(self._targets(ctx), "eval", ctx):
+            # Rules partitioned on multiple key values may match in many shards
+            matching.update(result)
+        ordered = sorted(matching, key=self._ranks.__getitem__)
+        if self.strategy in {Strategy.first, Strategy.top}:
+            ordered = ordered[: self.limit]
+        outcomes = chain.from_iterable(matching[rule_id] for rule_id in ordered)
+        if self.strategy == Strategy.limit:
+            outcomes = islice(outcomes, self.limit)
+        return list(outcomes)
+
+    def memory(self) -> list[int]:
+        """Returns the resident memory of each shard, in KiB."""
+        return self._query(range(self.shards), "memory")
+
+    def close(self):
+        """Stops the workers."""
+        for conn, worker in zip(self._conns, self._workers):
+            try:
+                conn.send(None)
+            except OSError:
+                # Already stopped
+                pass
+            conn.close()
+            worker.join()
+        self._conns = []
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,206 @@
+import inspect
+import json
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Transform:
+    """
+    A named transformation applied to context values before matching.
+    Transforms are referenced by name (eg. "lower", "hash_bucket:16")
+    so rules can be stored, serialized and sent to other processes.
+    """
+
+    # Below this size vectorizing costs more than transforming each value
+    min_batch = 16
+
+    def __init__(
+        self,
+        name: str,
+        fun: Callable,
+        pure: bool = True,
+        batch: Callable = None,
+        args: tuple = (),
+        check: Callable = None,
+    ):
+        self.name = name
+        self.fun = fun
+        self.check = check
+        # Pure transforms always return the same output for the same input,
+        # so their results can be memoized.
+        self.pure = pure
+        self._batch = batch
+        self.args = args
+
+    @property
+    def spec(self) -> str:
+        """Returns the serializable reference of the transform."""
+        if not self.args:
+            return self.name
+        return f"{self.name}:{','.join(self.args)}"
+
+    def __call__(self, val: Any) -> Any:
+        """Transforms the value, returning it untouched if not transformable."""
+        try:
+            return self.fun(val, *self.args)
+        except (TypeError, ValueError, OverflowError):
+            return val
+
+    def batch(self, values: list) -> list:
+        """
+        Transforms a list of values, using the vectorized implementation
+        if any for lists of at least `min_batch` values.
+        """
+        if self._batch is not None and len(values) >= self.min_batch:
+            try:
+                return self._batch(values, *self.args)
+            except (TypeError, ValueError, OverflowError):
+                # Fallback to the per-value transformation
+                pass
+        return [self(val) for val in values]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.spec})"
+
+
+_registry: dict[str, Transform] = {}
+
+
+def register(
+    name: str, pure: bool = True, batch: Callable = None, check: Callable = None
+) -> Callable:
+    """
+    Decorator registering a function as a named transform.
+    `check` validates the spec arguments, raising ValueError.
+    """
+
+    def decorator(fun: Callable) -> Callable:
+        _registry[name] = Transform(name, fun, pure=pure, batch=batch, check=check)
+        return fun
+
+    return decorator
+
+
+@lru_cache(maxsize=1024)
+def get_transform(spec: str) -> Transform:
+    """
+    Returns the transform referenced by the given spec.
+    Arguments are passed after a colon, comma separated: "hash_bucket:16".
+    """
+    name, _, args = spec.partition(":")
+    try:
+        transform = _registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown transform {name!r}") from None
+    if not args:
+        return transform
+    args = tuple(args.split(","))
+    try:
+        inspect.signature(transform.fun).bind(None, *args)
+    except TypeError:
+        raise ValueError(f"Wrong arguments for transform {spec!r}") from None
+    if transform.check:
+        transform.check(*args)
+    return Transform(
+        name,
+        transform.fun,
+        pure=transform.pure,
+        batch=transform._batch,
+        args=args,
+    )
+
+
+def resolve(transform: str | Callable | None) -> Transform | None:
+    """Returns a Transform from either a spec or an arbitrary callable."""
+    if transform is None or isinstance(transform, Transform):
+        return transform
+    if isinstance(transform, str):
+        return get_transform(transform)
+    # Arbitrary callables can't be assumed side-effects free
+    return Transform(repr(transform), transform, pure=False)
+
+
+def _np_float(values: list) -> list:
+    """
+    Vectorized float cast of numbers.
+    There is no vectorized int cast: numpy silently wraps values out of int64,
+    and string casts and methods are slower in numpy than in Python.
+    """
+    if np is None:
+        raise TypeError("numpy is not installed")
+    array = np.asarray(values)
+    if array.ndim != 1 or array.dtype.kind not in "biuf":
+        # Nested, string or object values (eg. None becomes nan)
+        raise TypeError("only numbers can be vectorized")
+    return array.astype(float).tolist()
+
+
+@register("lower")
+def lower(val: str) -> str:
+    return str.lower(val)
+
+
+@register("upper")
+def upper(val: str) -> str:
+    return str.upper(val)
+
+
+@register("strip")
+def strip(val: str) -> str:
+    return str.strip(val)
+
+
+@register("int")
+def to_int(val: Any) -> int:
+    return int(val)
+
+
+@register("float", batch=_np_float)
+def to_float(val: Any) -> float:
+    return float(val)
+
+
+@register("str")
+def to_str(val: Any) -> str:
+    return str(val)
+
+
+@register("json")
+def from_json(val: str) -> Any:
+    return json.loads(val)
+
+
+@register("len")
+def length(val: Any) -> int:
+    return len(val)
+
+
+@register("parse_datetime")
+def parse_datetime(val: str, fmt: str = None) -> datetime:
+    """Parses ISO formatted strings, or strings in the given strptime format."""
+    if isinstance(val, datetime):
+        return val
+    if fmt:
+        return datetime.strptime(val, fmt)
+    return datetime.fromisoformat(val)
+
+
+def _check_buckets(buckets: str):
+    if not buckets.isdigit() or int(buckets) < 1:
+        raise ValueError(f"Buckets must be a positive integer, not {buckets!r}")
+
+
+@register("hash_bucket", check=_check_buckets)
+def hash_bucket(val: Any, buckets: str = "100") -> int:
+    """
+    Returns a stable bucket number for the value.
+    Unlike `hash`, CRC32 is not salted and is the same in every process.
+    """
+    return zlib.crc32(str(val).encode()) % int(buckets)
@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip("sqlmodel")
+
+from empyre import Empyre  # noqa: E402
+from empyre.db.sqlmodels import DbMatcher, DbOutcome, DbRule  # noqa: E402
+from empyre.models import Comparator, Operator, OutcomeTypes  # noqa: E402
+
+
+def make_rule() -> DbRule:
+    return DbRule(
+        id=1,
+        name="fraud",
+        description="Big amounts from risky countries",
+        priority=2,
+        tenant="a",
+        matchers=[
+            DbMatcher(
+                id=1,
+                name="amount",
+                description="Big amount",
+                path="$.amount",
+                comp=Comparator.is_,
+                op=Operator.gt,
+                value="1000",
+                value_type="int",
+            ),
+            DbMatcher(
+                id=2,
+                name="country",
+                description="Risky country",
+                path="$",
+                comp=Comparator.is_,
+                op=Operator.or_,
+                matchers=[
+                    DbMatcher(
+                        id=3,
+                        name="listed",
+                        description="Listed country",
+                        path="$.country",
+                        comp=Comparator.is_,
+                        op=Operator.in_,
+                        value='["XX", "YY"]',
+                        value_type="json",
+                    ),
+                    DbMatcher(
+                        id=4,
+                        name="unknown",
+                        description="Unknown country",
+                        path="$.country",
+                        comp=Comparator.is_,
+                        op=Operator.eq,
+                        value="zz",
+                        transform="lower",
+                    ),
+                ],
+            ),
+        ],
+        outcomes=[
+            DbOutcome(
+                id=1,
+                name="event",
+                description="Fraud event",
+                typ=OutcomeTypes.EVENT,
+                event_id="fraud",
+                outputs='["$.amount", "$.country"]',
+            )
+        ],
+    )
+
+
+def test_to_rule():
+    rule = make_rule().to_rule()
+    assert rule.id == 1 and rule.priority == 2
+    amount, country = rule.matchers
+    # Values are cast with the value_type transform
+    assert amount.value == 1000
+    assert country.op == Operator.or_
+    listed, unknown = country.matchers
+    assert listed.value == ["XX", "YY"]
+    assert unknown.value == "zz" and unknown.transform == "lower"
+    # Outputs are stored as a JSON list
+    assert rule.outcomes[0].outputs == ["$.amount", "$.country"]
+
+    engine = Empyre([rule], {"amount": 5000, "country": "ZZ"})
+    (outcome,) = engine.outcomes()
+    assert outcome.data == {"amount": 5000, "country": "ZZ"}
+    engine.set_ctx({"amount": 500, "country": "XX"})
+    assert not list(engine.outcomes())
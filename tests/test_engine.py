@@ -1,8 +1,12 @@
+import json
+import multiprocessing
+import pickle
 from datetime import datetime, timedelta
 
 import pytest
 
-from empyre import Empyre
+from empyre import EngineRegistry, Empyre, ResultCache, ShardedEmpyre
+from empyre.transforms import get_transform
 
 
 def test_empty_engine():
@@ -311,3 +315,515 @@ def test_complex_rules():
 
     with pytest.raises(StopIteration):
         next(result)
+
+
+def test_transforms():
+    # Test named transforms
+    engine = Empyre(
+        [
+            {
+                "matchers": [
+                    {
+                        "path": "$.name",
+                        "op": "eq",
+                        "value": "bar",
+                        "transform": "lower",
+                    },
+                    {"path": "$.num", "op": "gt", "value": 41, "transform": "int"},
+                    {"path": "$.items", "op": "eq", "value": 3, "transform": "len"},
+                    {
+                        "path": "$.date",
+                        "op": "lt",
+                        "value": datetime.now(),
+                        "transform": "parse_datetime",
+                    },
+                    {
+                        "path": "$.name",
+                        "op": "in",
+                        "value": set(range(16)),
+                        "transform": "hash_bucket:16",
+                    },
+                ],
+                "outcomes": [{"typ": "VALUE", "value": "42"}],
+            },
+            {
+                # Untransformable values are matched as they are
+                "matchers": [
+                    {"path": "$.name", "op": "eq", "value": "BAR", "transform": "int"}
+                ],
+                "outcomes": [{"typ": "VALUE", "value": "43"}],
+            },
+            {
+                # Callables are still supported
+                "matchers": [
+                    {
+                        "path": "$.num",
+                        "op": "eq",
+                        "value": "42!",
+                        "transform": lambda val: f"{val}!",
+                    }
+                ],
+                "outcomes": [{"typ": "VALUE", "value": "44"}],
+            },
+        ],
+        {"name": "BAR", "num": "42", "items": [1, 2, 3], "date": "2020-01-01T00:00"},
+    )
+    assert [outcome.value for outcome in engine.outcomes()] == ["42", "43", "44"]
+
+    # Test unknown transforms and wrong arguments fail at validation
+    for transform in ("nope", "hash_bucket:0", "hash_bucket:1,2", "lower:1"):
+        with pytest.raises(ValueError):
+            Empyre(
+                [
+                    {
+                        "matchers": [
+                            {
+                                "path": "$.a",
+                                "op": "eq",
+                                "value": 1,
+                                "transform": transform,
+                            }
+                        ],
+                    }
+                ]
+            )
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["1", "2.5", " 3 ", "x"],
+        [1, 2.5, True, None],
+        [1e30, 2**70, float("nan"), "inf"],
+        [[1], [2]],
+        ["Ab", " Cd ", "e\0"],
+        ["Ab", 1],
+    ],
+)
+def test_batch_transforms(values):
+    # Vectorized transforms give the same results of the per-value ones
+    pytest.importorskip("numpy")
+    # Short lists are transformed per value
+    values = values * get_transform("float").min_batch
+    for spec in ("int", "float", "lower", "upper", "strip"):
+        transform = get_transform(spec)
+        assert repr(transform.batch(values)) == repr([transform(v) for v in values])
+
+
+def test_json_context():
+    rules = [
+        {
+            "matchers": [
+                {"path": "$.user.age", "op": "ge", "value": 18},
+                {"path": "$.tags[0]", "op": "eq", "value": "vip"},
+            ],
+            "outcomes": [
+                {"typ": "EVENT", "event_id": "test", "outputs": ["$.user.name"]},
+            ],
+        }
+    ]
+    doc = json.dumps(
+        {
+            "request_id": "abc",
+            "deep": [[[[[[[[[[{"a": "]"}]]]]]]]]]],
+            "payload": {"items": [{"id": i, "name": '}]"['} for i in range(10)]},
+            "user": {"name": "foo", "age": 42, "address": {"city": "bar"}},
+            "tags": ["vip", "new"],
+        }
+    )
+    # Test bytes and str contexts produce the same outcomes as dicts
+    for ctx in (doc.encode(), doc, json.loads(doc)):
+        engine = Empyre(rules, ctx)
+        outcome = next(engine.outcomes())
+        assert outcome.data["name"] == "foo"
+
+    # Only the paths read by the rules are decoded
+    assert engine.projection == {"user": {"age": None, "name": None}, "tags": None}
+    engine.set_ctx(doc.encode())
+    assert engine._ctx == {"user": {"name": "foo", "age": 42}, "tags": ["vip", "new"]}
+
+    # Paths of logical matchers are not read
+    logical = Empyre(
+        [
+            {
+                "matchers": [
+                    {
+                        "path": "$",
+                        "op": "or",
+                        "matchers": [{"path": "$.user.age", "op": "ge", "value": 18}],
+                    }
+                ],
+                "outcomes": [{"typ": "VALUE", "value": "ok"}],
+            }
+        ],
+        cache=ResultCache(),
+    )
+    assert logical.projection == {"user": {"age": None}}
+    for request_id in ("a", "b"):
+        logical.set_ctx({"request_id": request_id, "user": {"age": 42}})
+        assert [outcome.value for outcome in logical.outcomes()] == ["ok"]
+    assert logical.cache.stats.hits == 1
+
+    # Paths walking back up the context need the whole context
+    parent = [
+        {
+            "matchers": [{"path": "$.a.b.`parent`.c", "op": "eq", "value": 2}],
+            "outcomes": [{"typ": "VALUE", "value": "ok"}],
+        }
+    ]
+    for ctx in ({"a": {"b": 1, "c": 2}}, b'{"a": {"b": 1, "c": 2}}'):
+        outcomes = Empyre(parent, ctx).outcomes()
+        assert [outcome.value for outcome in outcomes] == ["ok"]
+
+    # Unanalyzable paths need the whole context
+    engine.add_rules([{"matchers": [{"path": "$..city", "op": "eq", "value": "x"}]}])
+    assert engine.projection is None
+    engine.set_ctx(doc.encode())
+    assert engine._ctx == json.loads(doc)
+
+    # Malformed JSON raises
+    with pytest.raises(json.JSONDecodeError):
+        Empyre(rules, doc[:-1])
+
+
+def test_strategies():
+    rules = [
+        {
+            "matchers": [{"path": "$.foo", "op": "eq", "value": "bar"}],
+            "outcomes": [{"typ": "VALUE", "value": "low"}],
+        },
+        {
+            "priority": 10,
+            "matchers": [{"path": "$.foo", "op": "eq", "value": "bar"}],
+            "outcomes": [
+                {"typ": "VALUE", "value": "high"},
+                {"typ": "RULE", "rule_id": 5},
+            ],
+        },
+        {
+            "priority": 5,
+            "matchers": [{"path": "$.foo", "op": "eq", "value": "baz"}],
+            "outcomes": [{"typ": "VALUE", "value": "failing"}],
+        },
+        {
+            "priority": 5,
+            "matchers": [{"path": "$.foo", "op": "eq", "value": "bar"}],
+            "outcomes": [{"typ": "VALUE", "value": "mid"}],
+        },
+        {
+            "id": 5,
+            "root": False,
+            "priority": 100,
+            "matchers": [{"path": "$.foo", "op": "eq", "value": "bar"}],
+            "outcomes": [{"typ": "VALUE", "value": "child"}],
+        },
+    ]
+
+    def values(**kwargs):
+        return [o.value for o in Empyre(rules, {"foo": "bar"}, **kwargs).outcomes()]
+
+    # Rules are evaluated by priority, then in insertion order
+    assert values() == ["high", "child", "mid", "low"]
+    # Only the first matching rule
+    assert values(strategy="first") == ["high", "child"]
+    # Only the top-k matching rules
+    assert values(strategy="top", limit=2) == ["high", "child", "mid"]
+    # Only the first N outcomes
+    assert values(strategy="limit", limit=3) == ["high", "child", "mid"]
+
+    # Limited strategies need a positive int limit, the others don't use it
+    for kwargs in (
+        {"strategy": "top"},
+        {"strategy": "top", "limit": -1},
+        {"strategy": "top", "limit": True},
+        {"strategy": "limit", "limit": 2.5},
+        {"strategy": "all", "limit": 2},
+        {"strategy": "first", "limit": 2},
+    ):
+        with pytest.raises(ValueError):
+            Empyre(rules, **kwargs)
+
+
+def test_result_cache():
+    calls = []
+
+    def impure(val):
+        calls.append(val)
+        return val
+
+    cache = ResultCache(maxsize=2)
+    engine = Empyre(
+        [
+            {
+                "matchers": [{"path": "$.foo", "op": "eq", "value": "bar"}],
+                "outcomes": [{"typ": "EVENT", "event_id": "e", "outputs": ["$.baz"]}],
+            },
+            {
+                "matchers": [
+                    {"path": "$.foo", "op": "eq", "value": "bar", "transform": impure}
+                ],
+                "outcomes": [{"typ": "VALUE", "value": "impure"}],
+            },
+        ],
+        cache=cache,
+    )
+
+    def evaluate(ctx):
+        engine.set_ctx(ctx)
+        return [getattr(o, "data", None) or o.value for o in engine.outcomes()]
+
+    # Fields not read by the rules don't change the fingerprint
+    assert evaluate({"foo": "bar", "baz": 1, "id": 1}) == [{"baz": 1}, "impure"]
+    assert evaluate({"foo": "bar", "baz": 1, "id": 2}) == [{"baz": 1}, "impure"]
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    # Rules with impure transforms are always evaluated
+    assert calls == ["bar", "bar"]
+
+    # Read fields change the fingerprint, and cached outcomes are not modified
+    assert evaluate({"foo": "bar", "baz": 2}) == [{"baz": 2}, "impure"]
+    assert evaluate({"foo": "bar", "baz": 1}) == [{"baz": 1}, "impure"]
+    assert evaluate({"foo": "baz", "baz": 1}) == []
+    assert (cache.stats.hits, cache.stats.misses) == (2, 3)
+    # Altering returned outcomes doesn't alter the next hits
+    engine.set_ctx({"foo": "bar", "baz": 1})
+    next(engine.outcomes()).data["baz"] = "altered"
+    assert evaluate({"foo": "bar", "baz": 1}) == [{"baz": 1}, "impure"]
+    assert (cache.stats.hits, cache.stats.misses) == (4, 3)
+    # LRU eviction
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+
+    # Adding rules invalidates the cache
+    engine.add_rules(
+        [
+            {
+                "matchers": [{"path": "$.foo", "op": "eq", "value": "baz"}],
+                "outcomes": [{"typ": "VALUE", "value": "new"}],
+            }
+        ]
+    )
+    misses = cache.stats.misses
+    assert evaluate({"foo": "baz", "baz": 1}) == ["new"]
+    assert cache.stats.misses == misses + 1
+
+    # TTL eviction
+    cache = ResultCache(ttl=0)
+    engine = Empyre(engine.rules.values(), cache=cache)
+    assert evaluate({"foo": "baz"}) == evaluate({"foo": "baz"}) == ["new"]
+    assert (cache.stats.hits, cache.stats.misses) == (0, 2)
+
+    # Engines sharing a cache don't share results
+    cache = ResultCache()
+    engines = {
+        tenant: Empyre(
+            [
+                {
+                    "matchers": [{"path": "$.x", "op": "eq", "value": 1}],
+                    "outcomes": [{"typ": "VALUE", "value": f"tenant {tenant}"}],
+                }
+            ],
+            {"x": 1},
+            cache=cache,
+        )
+        for tenant in "ab"
+    }
+    for _ in range(2):
+        for tenant, engine in engines.items():
+            assert [o.value for o in engine.outcomes()] == [f"tenant {tenant}"]
+    assert (cache.stats.hits, cache.stats.misses) == (2, 2)
+    # Adding rules to an engine doesn't invalidate the others
+    engines["a"].add_rules([])
+    assert [o.value for o in engines["b"].outcomes()] == ["tenant b"]
+    assert cache.stats.hits == 3
+
+
+def test_sharding():
+    rules = [
+        {
+            "id": 1,
+            "matchers": [
+                {"path": "$.tenant", "op": "eq", "value": "a"},
+                {"path": "$.amount", "op": "gt", "value": 10},
+            ],
+            "outcomes": [{"typ": "VALUE", "value": "a"}, {"typ": "RULE", "rule_id": 3}],
+        },
+        {
+            "id": 2,
+            "priority": 1,
+            "matchers": [{"path": "$.tenant", "op": "in", "value": ["a", "b"]}],
+            "outcomes": [{"typ": "VALUE", "value": "a or b"}],
+        },
+        {
+            "id": 3,
+            "root": False,
+            "matchers": [{"path": "$.amount", "op": "gt", "value": 100}],
+            "outcomes": [
+                {"typ": "VALUE", "value": "big"},
+                {"typ": "RULE", "rule_id": 4},
+            ],
+        },
+        {
+            # Unkeyed rule, also used as child
+            "id": 4,
+            "matchers": [{"path": "$.amount", "op": "gt", "value": 1000}],
+            "outcomes": [{"typ": "VALUE", "value": "huge"}],
+        },
+    ]
+    ctxs = [
+        {"tenant": "a", "amount": 5000},
+        {"tenant": "a", "amount": 50},
+        {"tenant": "b", "amount": 5000},
+        {"tenant": "c", "amount": 5},
+    ]
+    for key in (None, "$.tenant"):
+        for kwargs in ({}, {"strategy": "first"}, {"strategy": "limit", "limit": 2}):
+            with ShardedEmpyre(rules, shards=3, key=key, **kwargs) as sharded:
+                for ctx in ctxs:
+                    # Sharded outcomes are the same of a single engine
+                    expected = [
+                        o.value for o in Empyre(rules, ctx, **kwargs).outcomes()
+                    ]
+                    assert [o.value for o in sharded.outcomes(ctx)] == expected
+                # Raw JSON contexts
+                assert [o.value for o in sharded.outcomes(json.dumps(ctxs[0]))]
+                assert len(sharded.memory()) == 3
+
+    # Keys must be analyzable paths
+    with pytest.raises(ValueError):
+        ShardedEmpyre(rules, key="$..tenant")
+
+    # Equal numbers are routed to the same shard, other values are not partitioned
+    for rules, ctxs in (
+        (
+            [
+                {
+                    "matchers": [{"path": "$.tenant", "op": "eq", "value": 1}],
+                    "outcomes": [{"typ": "VALUE", "value": "int"}],
+                },
+                {
+                    "matchers": [{"path": "$.tenant", "op": "eq", "value": True}],
+                    "outcomes": [{"typ": "VALUE", "value": "bool"}],
+                },
+                {
+                    "matchers": [{"path": "$.tenant", "op": "eq", "value": 2.0}],
+                    "outcomes": [{"typ": "VALUE", "value": "float"}],
+                },
+            ],
+            [{"tenant": t} for t in (1, 1.0, True, 2, 2.0, None)],
+        ),
+        (
+            [
+                {
+                    "matchers": [{"path": "$.tenant", "op": "in", "value": "abc"}],
+                    "outcomes": [{"typ": "VALUE", "value": "substring"}],
+                },
+            ],
+            [{"tenant": t} for t in ("ab", "a", "abc", "x")],
+        ),
+    ):
+        with ShardedEmpyre(rules, shards=7, key="$.tenant") as sharded:
+            for ctx in ctxs:
+                expected = [o.value for o in Empyre(rules, ctx).outcomes()]
+                assert [o.value for o in sharded.outcomes(ctx)] == expected
+
+    # Stopped workers raise errors
+    with ShardedEmpyre(rules, shards=2) as sharded:
+        sharded._workers[0].kill()
+        sharded._workers[0].join()
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                sharded.outcomes(ctxs[0])
+
+    with pytest.raises(ValueError):
+        ShardedEmpyre(rules, shards=0)
+    # Workers already started are stopped when a shard can't be spawned
+    unpicklable = [
+        {"id": 4, "matchers": [{"path": "$.a", "op": "eq", "value": 1}]},
+        {
+            "id": 1,
+            "matchers": [
+                {"path": "$.a", "op": "eq", "value": 1, "transform": lambda v: v}
+            ],
+        },
+    ]
+    with pytest.raises((AttributeError, pickle.PicklingError)):
+        ShardedEmpyre(unpicklable, shards=2)
+    assert not multiprocessing.active_children()
+
+
+def test_registry():
+    tenants = {
+        tenant: [
+            {
+                # Same conditions, with different ids and names
+                "matchers": [
+                    {
+                        "id": i,
+                        "name": tenant,
+                        "path": "$.amount",
+                        "op": "gt",
+                        "value": 1000,
+                    },
+                    {"path": "$.country", "op": "in", "value": ["XX", "YY"]},
+                ],
+                "outcomes": [{"typ": "VALUE", "value": f"fraud {tenant}"}],
+            },
+            {
+                "matchers": [{"path": "$.amount", "op": "gt", "value": i + 1}],
+                "outcomes": [{"typ": "VALUE", "value": tenant}],
+            },
+        ]
+        for i, tenant in enumerate(["a", "b", "c"])
+    }
+    loaded = []
+
+    def loader(tenant):
+        loaded.append(tenant)
+        return tenants[tenant]
+
+    with pytest.raises(ValueError):
+        EngineRegistry(loader, cache=ResultCache())
+    registry = EngineRegistry(loader, cache_factory=ResultCache)
+    a = registry.get("a")
+    a_memory = registry.stats["a"].memory
+    assert registry.memory == a_memory and registry.shared_memory == 0
+    b = registry.get("b")
+    # Tenants are loaded once
+    assert registry.get("a") is a
+    assert loaded == ["a", "b"]
+    assert registry.stats["a"].hits == 1
+    assert registry.stats["a"].loads == 1
+    # Identical values are shared between tenants, keeping their own matchers
+    a_matcher, b_matcher = a.rules[0].matchers[1], b.rules[0].matchers[1]
+    assert a_matcher is not b_matcher and a_matcher.value is b_matcher.value
+    assert a.rules[1].matchers[0].value != b.rules[1].matchers[0].value
+    assert a.rules[0].matchers[0].name == "a" and b.rules[0].matchers[0].name == "b"
+    # Shared values are immutable
+    with pytest.raises(TypeError):
+        a_matcher.value.append("ZZ")
+    a_matcher.value = ["ZZ"]
+    assert b_matcher.value == ["XX", "YY"]
+    a.set_ctx({"amount": 5000, "country": "ZZ"})
+    assert [outcome.value for outcome in a.outcomes()] == ["fraud a", "a"]
+    # Each tenant has its own cache
+    assert a.cache is not None and a.cache is not b.cache
+    # Shared objects are no longer accounted to their first tenant
+    assert 0 < registry.shared_memory
+    assert registry.stats["a"].memory == a_memory - registry.shared_memory
+    assert registry.memory == (
+        registry.stats["a"].memory + registry.stats["b"].memory + registry.shared_memory
+    )
+    registry.evict("b")
+    assert registry.shared_memory == 0
+    assert registry.stats["a"].memory == registry.memory == a_memory
+
+    # Least recently used tenants are evicted over the memory budget
+    registry.get("b")
+    registry.max_memory = registry.memory
+    registry.get("a")
+    registry.get("c")
+    assert "a" in registry and "c" in registry and "b" not in registry
+    assert registry.stats["b"].memory == 0
+    assert registry.memory <= registry.max_memory
+    registry.get("b")
+    assert registry.stats["b"].loads == 3